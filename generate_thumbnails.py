@@ -1,5 +1,9 @@
 import argparse
 import os
+import sys
+import resource
+from contextlib import contextmanager
+from io import BytesIO
 from glob import glob
 import yaml
 import re
@@ -35,6 +39,18 @@ parser.add_argument(
     required=True,
     help="filepath to the sans serif font",
 )
+parser.add_argument(
+    "--max-image-pixels",
+    type=int,
+    default=50_000_000,
+    help="maximum number of decompressed pixels allowed per preview image; larger previews are skipped",
+)
+parser.add_argument(
+    "--max-download-bytes",
+    type=int,
+    default=20 * 1024 * 1024,
+    help="maximum size in bytes of a downloaded preview image; larger downloads are aborted and the preview skipped",
+)
 
 
 def main():
@@ -51,6 +67,8 @@ def main():
 
     serif = args.serif_font
     sansserif = args.sans_serif_font
+    max_pixels = args.max_image_pixels
+    max_bytes = args.max_download_bytes
 
     for recipe in recipes:
         if "view-all.md" in recipe:
@@ -65,9 +83,18 @@ def main():
         if "title" in front_matter:
             print("Creating thumbnail for " + recipe + "... ", end="", flush=True)
             page_bundle = os.path.dirname(recipe)
-            image = create_thumbnail(front_matter, page_bundle, serif, sansserif)
-            write_image(image, recipe, args.output_dir)
-            print("OK")
+            was_reset = reset_peak_memory()
+            image = create_thumbnail(
+                front_matter, page_bundle, serif, sansserif, max_pixels, max_bytes
+            )
+            try:
+                write_image(image, recipe, args.output_dir)
+            finally:
+                image.close()
+            # Without a reset the peak covers every recipe processed so far
+            scope = "" if was_reset else " since start"
+            peak = get_peak_memory() / 1024
+            print(f"OK (peak process RSS{scope} {peak:.1f} MiB)")
 
     print("Done.")
 
@@ -105,12 +132,20 @@ def get_front_matter(contents: list[str]) -> dict:
 
 
 def create_thumbnail(
-    front_matter: dict, page_bundle: str, serif: str, sansserif: str
+    front_matter: dict,
+    page_bundle: str,
+    serif: str,
+    sansserif: str,
+    max_pixels: int,
+    max_bytes: int,
 ) -> Image.Image:
     """
     Create an thumbnail Pillow image, load the background image if any (from
     the page bundle directory), create the heading with background (each on
     separate layer, then flattened in order), similarly add metadata and logo.
+    Previews over max_pixels pixels or max_bytes bytes (when downloaded) are
+    skipped. The caller owns the returned image and should close() it once
+    written.
     """
     im = Image.new("RGB", (1200, 600), (255, 255, 255))
 
@@ -129,7 +164,7 @@ def create_thumbnail(
         "max_lines": 3,
     }
 
-    draw_bg_in_place(im, front_matter, page_bundle)
+    draw_bg_in_place(im, front_matter, page_bundle, max_pixels, max_bytes)
     bottom = draw_heading_in_place(im, front_matter, heading_opts)
 
     metadata_opts = {
@@ -151,31 +186,40 @@ def create_thumbnail(
     return im
 
 
-def draw_bg_in_place(im: Image.Image, front_matter: dict, page_bundle: str) -> None:
+def draw_bg_in_place(
+    im: Image.Image,
+    front_matter: dict,
+    page_bundle: str,
+    max_pixels: int,
+    max_bytes: int,
+) -> None:
     """
     Download, scale, and draw the background (preview) image in place if it exists.
     Done in place.
     """
     if "previewimage" in front_matter:
         try:
-            if front_matter["previewimage"][:7] in ["https:/", "http://"]:
-                bg = Image.open(
-                    requests.get(front_matter["previewimage"], stream=True).raw
-                )
-            else:
+            source = front_matter["previewimage"]
+            if source[:7] not in ["https:/", "http://"]:
                 # load file locally
-                bg = Image.open(os.path.join(page_bundle, front_matter["previewimage"]))
-            # Resize to fill.
-            if bg.size[0] < 1200:
-                bg = bg.resize(
-                    (1200, int(1200 / bg.size[0]) * bg.size[1]), Image.ANTIALIAS
-                )
-            if bg.size[1] < 600:
-                bg = bg.resize(
-                    (int(600 / bg.size[1]) * bg.size[0], 600), Image.ANTIALIAS
-                )
-
-            im.paste(bg)
+                source = os.path.join(page_bundle, source)
+            with open_source_image(source, max_pixels, max_bytes) as bg:
+                # Resize to fill. The final size is worked out first so that
+                # only one resized copy is ever allocated.
+                width, height = bg.size
+                if width < 1200:
+                    width, height = 1200, int(1200 / width) * height
+                if height < 600:
+                    width, height = int(600 / height) * width, 600
+
+                if (width, height) == bg.size:
+                    im.paste(bg)
+                else:
+                    resized = bg.resize((width, height), Image.ANTIALIAS)
+                    try:
+                        im.paste(resized)
+                    finally:
+                        resized.close()
         except Exception as e:
             print(e)
             pass
@@ -270,7 +314,9 @@ def draw_heading_in_place(
                 )
 
     im.paste(box_layer, (0, 0), box_layer)
+    box_layer.close()
     im.paste(text_layer, (0, 0), text_layer)
+    text_layer.close()
 
     return return_value
 
@@ -378,6 +424,7 @@ def draw_metadata_in_place(
                 )
 
     im.paste(box_layer, (0, 0), box_layer)
+    box_layer.close()
 
     # Draw the labels
     text_draw.text(
@@ -422,6 +469,7 @@ def draw_metadata_in_place(
     )
 
     im.paste(text_layer, (0, 0), text_layer)
+    text_layer.close()
 
 
 def draw_logo_in_place(im: Image.Image, logo_path: str) -> None:
@@ -429,8 +477,86 @@ def draw_logo_in_place(im: Image.Image, logo_path: str) -> None:
     Draw the Cookbook logo at the bottom right corner.
     """
     logo = Image.open(logo_path)
-    logo = logo.resize((322, 51), Image.ANTIALIAS)
-    im.paste(logo, (1200 - 322 - 50, 600 - 51 - 50), logo)
+    try:
+        resized = logo.resize((322, 51), Image.ANTIALIAS)
+    finally:
+        logo.close()
+    try:
+        im.paste(resized, (1200 - 322 - 50, 600 - 51 - 50), resized)
+    finally:
+        resized.close()
+
+
+@contextmanager
+def open_source_image(source: str, max_pixels: int, max_bytes: int):
+    """
+    Open a local file or an http(s) URL as a Pillow image, and close() it on
+    exit, freeing its pixels. Downloads are read into memory up to max_bytes
+    bytes and aborted with a ValueError beyond that. Only the header is read
+    before checking the size, so images that would decompress to more than
+    max_pixels pixels are rejected with a ValueError without being decoded.
+    """
+    if source[:7] in ["https:/", "http://"]:
+        with requests.get(source, stream=True) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            if length is not None and int(length) > max_bytes:
+                raise ValueError(f"{source} is {length} bytes, over the limit")
+
+            data = BytesIO()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data.write(chunk)
+                if data.tell() > max_bytes:
+                    raise ValueError(f"{source} is over {max_bytes} bytes")
+        data.seek(0)
+        image = Image.open(data)
+    else:
+        image = Image.open(source)
+
+    try:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ValueError(
+                f"{source} is {width}x{height}, over the {max_pixels} pixel limit"
+            )
+
+        yield image
+    finally:
+        image.close()
+
+
+def reset_peak_memory() -> bool:
+    """
+    Reset the peak resident set size of this process, so that get_peak_memory()
+    only covers what happened afterwards. Only supported on Linux; returns False
+    if the reset was not possible, in which case the peak is for the whole
+    lifetime of the process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def get_peak_memory() -> int:
+    """
+    Get the peak resident set size of this process in KiB. This is for the
+    whole process, so it includes the interpreter, modules and fonts too.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports this in bytes, Linux in KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
 
 
 if __name__ == "__main__":